@@ -1,9 +1,54 @@
-import re
-from typing import List, Dict
+from typing import Any, Iterator, List, Dict, Optional
+
+_KEYS = frozenset({'File', 'Line', 'Problem', 'Why', 'Solution'})
+
+# Bump whenever parse_ai_issues output changes, so cached parse results are not reused
+PARSER_VERSION = 1
+
+def _leading_int(value: str) -> Optional[int]:
+    """
+    Returns the integer formed by the leading digits of value, or None if it
+    does not start with a digit (e.g. "42-45" -> 42).
+    """
+    end = 0
+    while end < len(value) and value[end].isdigit():
+        end += 1
+    return int(value[:end]) if end else None
+
+def _issue_from_fields(fields: Dict[str, str]) -> Optional[Dict]:
+    """
+    Builds an issue dictionary from the "Key: value" fields of one block, or
+    returns None if the block lacks a file, line number or problem.
+    """
+    line_no = _leading_int(fields.get('Line', ''))
+    if not fields.get('File') or line_no is None or not fields.get('Problem'):
+        return None
+    return {
+        'file': fields['File'],
+        'line': line_no,
+        'problem': fields['Problem'],
+        'why': fields.get('Why', ''),
+        'solution': fields.get('Solution', '')
+    }
+
+def _iter_lines(text: str) -> Iterator[str]:
+    """
+    Yields the lines of text one at a time (without line endings), so only
+    the current line is materialised rather than a list of every line.
+    """
+    i = 0
+    end = len(text)
+    while i < end:
+        j = text.find('\n', i)
+        if j == -1:
+            j = end
+        yield text[i:j].rstrip('\r')
+        i = j + 1
 
 def parse_ai_issues(report_text: str) -> List[Dict]:
     """
     Parses the AI output to extract structured issue data for inline comments.
+    Used as a fallback when no structured (JSON) issue list is available.
 
     Args:
         report_text: The AI's markdown-formatted analysis report.
@@ -17,19 +62,109 @@ def parse_ai_issues(report_text: str) -> List[Dict]:
             - solution: suggested fix (str)
     """
     issues = []
-    # Split issues by '---'
-    for issue_block in report_text.split('---'):
-        file_match = re.search(r'File:\s*(.+)', issue_block)
-        line_match = re.search(r'Line:\s*(\d+)', issue_block)
-        problem_match = re.search(r'Problem:\s*(.+)', issue_block)
-        why_match = re.search(r'Why:\s*(.+)', issue_block)
-        solution_match = re.search(r'Solution:\s*(.+)', issue_block)
-        if file_match and line_match and problem_match:
-            issues.append({
-                'file': file_match.group(1).strip(),
-                'line': int(line_match.group(1)),
-                'problem': problem_match.group(1).strip(),
-                'why': why_match.group(1).strip() if why_match else '',
-                'solution': solution_match.group(1).strip() if solution_match else ''
-            })
-    return issues
\ No newline at end of file
+    fields = {}
+    # Single lazy pass over the report; lines starting with '---' close the current issue
+    for line in _iter_lines(report_text):
+        if line.startswith('---'):
+            issue = _issue_from_fields(fields)
+            if issue:
+                issues.append(issue)
+            fields = {}
+            continue
+        key, sep, value = line.partition(':')
+        # Tolerate list bullets and bold keys, e.g. "- File:", "**File:**" or "**File**:"
+        key = key.strip().strip('-* ')
+        value = value.strip()
+        if value.startswith('**'):
+            # Closing bold marker of "**File:** value"
+            value = value[2:].strip()
+        if sep and value and key in _KEYS and key not in fields:
+            fields[key] = value
+    issue = _issue_from_fields(fields)
+    if issue:
+        issues.append(issue)
+    return issues
+
+def issues_from_json(data: Any) -> Optional[List[Dict]]:
+    """
+    Normalizes a structured-output AI response into the issue format used by
+    parse_ai_issues.
+
+    Args:
+        data: The decoded JSON response, either {"issues": [...]} or a bare list.
+
+    Returns:
+        A list of issue dictionaries (file, line, problem, why, solution,
+        severity), one per reported entry, or None if data does not have the
+        expected shape. Nothing the model reported is dropped: issues that are
+        not tied to a diff line (e.g. dependency conflicts) have file '' and/or
+        line None, and are only left out of inline comments.
+    """
+    if isinstance(data, dict):
+        data = data.get('issues')
+    if not isinstance(data, list):
+        return None
+    issues = []
+    for item in data:
+        if not isinstance(item, dict):
+            item = {'problem': item}
+        line = item.get('line')
+        if isinstance(line, str):
+            line = _leading_int(line.strip())
+        elif isinstance(line, bool) or not isinstance(line, int):
+            line = None
+        issues.append({
+            'file': str(item.get('file') or '').strip(),
+            'line': line,
+            'problem': str(item.get('problem') or '').strip(),
+            'why': str(item.get('why') or '').strip(),
+            'solution': str(item.get('solution') or '').strip(),
+            'severity': str(item.get('severity') or '').strip()
+        })
+    return issues
+
+def is_inline_issue(issue: Dict) -> bool:
+    """
+    Returns True if the issue names a file and a line, so it can be posted as
+    an inline review comment.
+    """
+    line = issue.get('line')
+    return bool(issue.get('file')) and isinstance(line, int) and not isinstance(line, bool)
+
+def _one_line(text: str) -> str:
+    """Collapses text onto a single line so it fits a "Key: value" line or table cell."""
+    return ' '.join(text.split())
+
+def format_issues_report(issues: List[Dict]) -> str:
+    """
+    Renders structured issues as the Markdown report shown on the PR.
+
+    The per-issue blocks use the same "File:/Line:/Problem:/Why:/Solution:"
+    layout that parse_ai_issues reads, separated by '---'.
+
+    Args:
+        issues: Issue dictionaries as returned by issues_from_json.
+
+    Returns:
+        The Markdown report text.
+    """
+    if not issues:
+        return "No issues detected."
+    rows = ["| File | Line | Issue | Severity |", "|------|------|-------|----------|"]
+    blocks = []
+    for issue in issues:
+        problem = _one_line(issue['problem']) or '(no description)'
+        line = issue['line'] if issue['line'] is not None else '-'
+        cell = problem.replace('|', '\\|')
+        rows.append(f"| {issue['file'] or '-'} | {line} | {cell} | {issue.get('severity') or '-'} |")
+        block = []
+        # Issues not tied to a file/line are listed without those keys
+        if issue['file']:
+            block.append(f"- File: {issue['file']}")
+        if issue['line'] is not None:
+            block.append(f"- Line: {issue['line']}")
+        block.append(f"- Problem: {problem}")
+        block.append(f"- Why: {_one_line(issue['why'])}")
+        block.append(f"- Solution: {_one_line(issue['solution'])}")
+        blocks.append("\n".join(block))
+    return "\n".join(rows) + "\n\n" + "\n---\n".join(blocks)
\ No newline at end of file
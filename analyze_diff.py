@@ -2,8 +2,66 @@
 # It reads input from environment variables, calls the AI API, and writes results to files.
 
 import os
+import gzip
+from typing import Optional
 import requests
-import json
+import orjson
+from ai_postprocess import issues_from_json, format_issues_report
+
+# Response schema for Gemini structured output: one object per detected issue.
+ISSUES_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "issues": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "file": {"type": "STRING"},
+                    "line": {"type": "INTEGER"},
+                    "problem": {"type": "STRING"},
+                    "why": {"type": "STRING"},
+                    "solution": {"type": "STRING"},
+                    "severity": {"type": "STRING"}
+                },
+                "required": ["file", "line", "problem"]
+            }
+        }
+    },
+    "required": ["issues"]
+}
+
+# The comprehensive prompt for the AI, split around the diff content.
+# This prompt guides the AI on what to look for and how to format its response.
+PROMPT_HEADER = """
+You are an AI assistant specialized in identifying potential issues during code merges.
+Analyze the following Git diff content and highlight any potential:
+1. Merge Conflicts
+2. Breaking Changes
+3. Architectural Incompatibilities
+4. Dependency Conflicts
+5. Logical Errors/Unexpected Side Effects
+6. Performance or Scalability Regressions
+7. Security Vulnerabilities
+8. Secret or Credential Exposure
+9. Other Security Vulnerabilities
+
+**IMPORTANT INSTRUCTIONS:**
+- For each issue, reference the **exact file name and line number** as shown in the diff.
+- Only comment on lines present in the diff. Do **not invent or hallucinate** line numbers or files.
+- Reference the **specific line** where the problematic code appears. If the issue spans multiple lines, use the first line where the problem starts.
+- Avoid referencing unrelated lines or code that does not contain the issue.
+
+**Git Diff Content for Analysis:**"""
+
+PROMPT_FOOTER = """
+Respond with a single JSON object of this form:
+{"issues": [{"file": "<filename>", "line": <line number>, "problem": "<description>", "why": "<reason>", "solution": "<suggested fix>", "severity": "<Low|Medium|High|Critical>"}]}
+
+If no obvious issues are apparent based on the provided diff, return {"issues": []}.
+
+Keep each text field concise and on a single line.
+"""
 
 def construct_gemini_payload(prompt: str, model_name: str) -> dict:
     """
@@ -21,17 +79,11 @@ def construct_gemini_payload(prompt: str, model_name: str) -> dict:
                 "parts": [{"text": prompt}]
             }
         ],
-        # Optional: Add generation config for structured output if needed in the future
-        # "generationConfig": {
-        #     "responseMimeType": "application/json",
-        #     "responseSchema": {
-        #         "type": "OBJECT",
-        #         "properties": {
-        #             "analysisReport": {"type": "STRING"},
-        #             "status": {"type": "STRING"}
-        #         }
-        #     }
-        # }
+        # Ask for strict JSON matching the issue schema instead of free-form Markdown
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": ISSUES_RESPONSE_SCHEMA
+        }
     }
     return payload
 
@@ -50,22 +102,74 @@ def construct_openai_payload(prompt: str, model_name: str) -> dict:
             {"role": "user", "content": prompt}
         ],
         "max_tokens": 2000, # Max tokens for the AI's response
-        "temperature": 0.7 # Controls randomness, 0.7 is usually good for analytical tasks
+        "temperature": 0.7, # Controls randomness, 0.7 is usually good for analytical tasks
+        # JSON mode; the expected object shape is spelled out in the prompt
+        "response_format": {"type": "json_object"}
     }
     return payload
 
-# You can add more functions here for other AI providers, e.g.,
-# def construct_anthropic_payload(prompt: str, model_name: str) -> dict:
-#     # ... Anthropic specific payload ...
-#     pass
+def gemini_endpoint(api_base_url: str, api_key: str, model_name: str) -> tuple[str, dict]:
+    """
+    Builds the request URL and extra headers for the Google Gemini API.
+    Args:
+        api_base_url: Optional base URL; empty for the public Gemini endpoint.
+        api_key: The Gemini API key.
+        model_name: The specific Gemini model name (e.g., 'gemini-2.0-flash').
+    Returns:
+        A tuple of (request URL, extra request headers).
+    """
+    # For Gemini, the API key is typically a query parameter
+    base_url = api_base_url or "https://generativelanguage.googleapis.com/v1beta/models"
+    return f"{base_url}/{model_name}:generateContent?key={api_key}", {}
+
+def openai_endpoint(api_base_url: str, api_key: str, model_name: str) -> tuple[str, dict]:
+    """
+    Builds the request URL and extra headers for the OpenAI Chat Completions API.
+    Args:
+        api_base_url: Optional base URL; empty for the public OpenAI endpoint.
+        api_key: The OpenAI API key.
+        model_name: Unused; OpenAI takes the model in the payload.
+    Returns:
+        A tuple of (request URL, extra request headers).
+    """
+    # For OpenAI, the API key is an Authorization header
+    base_url = api_base_url or "https://api.openai.com/v1"
+    return f"{base_url}/chat/completions", {'Authorization': f'Bearer {api_key}'}
+
+def extract_gemini_text(result: dict) -> str:
+    """
+    Extracts the generated text from a Gemini API response, or "" if absent.
+    """
+    if result.get('candidates') and result['candidates'][0].get('content') and result['candidates'][0]['content'].get('parts'):
+        return result['candidates'][0]['content']['parts'][0]['text']
+    return ""
+
+def extract_openai_text(result: dict) -> str:
+    """
+    Extracts the generated text from an OpenAI API response, or "" if absent.
+    """
+    if result.get('choices') and result['choices'][0].get('message') and result['choices'][0]['message'].get('content'):
+        return result['choices'][0]['message']['content']
+    return ""
+
+# Provider name -> (endpoint builder, payload builder, response text extractor).
+# To add a provider, write these three functions and register them here, e.g.
+# 'anthropic': (anthropic_endpoint, construct_anthropic_payload, extract_anthropic_text)
+# where anthropic_endpoint returns ("https://api.anthropic.com/v1/messages",
+# {'x-api-key': api_key, 'anthropic-version': '2023-06-01'}).
+_PROVIDERS = {
+    'gemini': (gemini_endpoint, construct_gemini_payload, extract_gemini_text),
+    'openai': (openai_endpoint, construct_openai_payload, extract_openai_text),
+}
 
 def analyze_merge_issues(
     diff_content: str,
     ai_provider: str,
     api_key: str,
     model_name: str,
-    api_base_url: str = ""
-) -> tuple[str, str]:
+    api_base_url: str = "",
+    compress_request: bool = False
+) -> tuple[str, str, Optional[list[dict]]]:
     """
     Connects to the specified AI provider to analyze Git diff content.
 
@@ -75,126 +179,80 @@ def analyze_merge_issues(
         api_key: The API key for the chosen AI service.
         model_name: The specific model name to use.
         api_base_url: Optional base URL for the API.
+        compress_request: Gzip the request body (sent with Content-Encoding: gzip).
+            Only enable this for endpoints that accept compressed requests.
 
     Returns:
-        A tuple: (analysis_report_text, status_string)
+        A tuple: (analysis_report_text, status_string, issues)
         - analysis_report_text: The detailed report from the AI.
         - status_string: "PASS" or "FAIL" based on AI's overall assessment.
+        - issues: The structured issue list, or None if the AI did not return
+          valid structured output (or an error occurred).
     """
     if not diff_content.strip():
-        return "Error: No branch differences provided for analysis.", "FAIL"
+        return "Error: No branch differences provided for analysis.", "FAIL", None
     if not api_key:
-        return f"Error: API key for {ai_provider} not provided. Please set the 'ai_api_key' input.", "FAIL"
-
-    # Define the comprehensive prompt for the AI.
-    # This prompt guides the AI on what to look for and how to format its response.
-    prompt = f"""
-        You are an AI assistant specialized in identifying potential issues during code merges.
-        Analyze the following Git diff content and highlight any potential:
-        1. Merge Conflicts
-        2. Breaking Changes
-        3. Architectural Incompatibilities
-        4. Dependency Conflicts
-        5. Logical Errors/Unexpected Side Effects
-        6. Performance or Scalability Regressions
-        7. Security Vulnerabilities
-        8. Secret or Credential Exposure
-        9. Other Security Vulnerabilities
-
-        **IMPORTANT INSTRUCTIONS:**
-        - For each issue, reference the **exact file name and line number** as shown in the diff.
-        - Only comment on lines present in the diff. Do **not invent or hallucinate** line numbers or files.
-        - Reference the **specific line** where the problematic code appears. If the issue spans multiple lines, use the first line where the problem starts.
-        - Avoid referencing unrelated lines or code that does not contain the issue.
-
-        **Git Diff Content for Analysis:**
-        ```diff
-        {diff_content}
-        ```
-
-        At the top of your response, include a Markdown table summarizing all detected issues. The table should have columns: File, Line, Issue, Severity. If no issues are found, state "No issues detected" in the table.
-
-        After the table, for each issue, provide:
-        - File: <filename>
-        - Line: <line number>
-        - Problem: <description>
-        - Why: <reason>
-        - Solution: <suggested fix>
-        Separate each issue with '---'.
-
-        If no obvious issues are apparent based on the provided diff, state that explicitly.
-
-        Format your response clearly using standard Markdown. Keep lines concise for readability.
-
-        On a new line at the very end of your response, provide an overall status using one of these exact phrases:
-        "Overall Status: PASS" or "Overall Status: FAIL"
-        """
-
-    # Prepare headers for the API request
+        return f"Error: API key for {ai_provider} not provided. Please set the 'ai_api_key' input.", "FAIL", None
+
+    provider = _PROVIDERS.get(ai_provider.lower())
+    if provider is None:
+        supported = ", ".join(f"'{name}'" for name in _PROVIDERS)
+        return f"Error: Unsupported AI provider '{ai_provider}'. Supported providers are {supported}.", "FAIL", None
+    endpoint_fn, payload_fn, extract_fn = provider
+
+    # Assemble the prompt around the diff in a single join, so a large diff is copied only once
+    prompt = "".join((PROMPT_HEADER, "\n```diff\n", diff_content, "\n```\n", PROMPT_FOOTER))
+
+    final_api_url, provider_headers = endpoint_fn(api_base_url, api_key, model_name)
     headers = {
         'Content-Type': 'application/json',
+        **provider_headers
     }
-    final_api_url = ""
-    payload = {}
-
-    # Logic to construct API URL and payload based on the AI provider
-    if ai_provider.lower() == 'gemini':
-        # For Gemini, the API key is typically a query parameter
-        base_url = api_base_url if api_base_url else "https://generativelanguage.googleapis.com/v1beta/models"
-        final_api_url = f"{base_url}/{model_name}:generateContent?key={api_key}"
-        payload = construct_gemini_payload(prompt, model_name)
-    elif ai_provider.lower() == 'openai':
-        # For OpenAI, the API key is an Authorization header
-        base_url = api_base_url if api_base_url else "https://api.openai.com/v1"
-        final_api_url = f"{base_url}/chat/completions"
-        headers['Authorization'] = f'Bearer {api_key}'
-        payload = construct_openai_payload(prompt, model_name)
-    # Add more elif blocks here for other providers as needed
-    # elif ai_provider.lower() == 'anthropic':
-    #     base_url = api_base_url if api_base_url else "https://api.anthropic.com/v1"
-    #     final_api_url = f"{base_url}/messages"
-    #     headers['x-api-key'] = api_key
-    #     headers['anthropic-version'] = '2023-06-01' # Required for Anthropic
-    #     payload = construct_anthropic_payload(prompt, model_name)
-    else:
-        return f"Error: Unsupported AI provider '{ai_provider}'. Supported providers are 'gemini', 'openai'.", "FAIL"
+    payload = payload_fn(prompt, model_name)
 
     try:
         # Make the HTTP POST request to the AI API
-        response = requests.post(final_api_url, headers=headers, data=json.dumps(payload), timeout=300) # 5 min timeout
+        body = orjson.dumps(payload)
+        if compress_request:
+            # Diffs are highly compressible text, so this cuts upload size several-fold
+            body = gzip.compress(body, compresslevel=6)
+            headers['Content-Encoding'] = 'gzip'
+        response = requests.post(final_api_url, headers=headers, data=body, timeout=300) # 5 min timeout
         response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
 
-        result = response.json()
-        analysis_text = ""
+        result = orjson.loads(response.content)
 
         # Extract the AI's generated content based on the provider's JSON structure
-        if ai_provider.lower() == 'gemini':
-            if result.get('candidates') and result['candidates'][0].get('content') and result['candidates'][0]['content'].get('parts'):
-                analysis_text = result['candidates'][0]['content']['parts'][0]['text']
-        elif ai_provider.lower() == 'openai':
-            if result.get('choices') and result['choices'][0].get('message') and result['choices'][0]['message'].get('content'):
-                analysis_text = result['choices'][0]['message']['content']
-        # Add content extraction logic for other providers here
+        analysis_text = extract_fn(result)
 
         if not analysis_text:
-            return f"No analysis result found from {ai_provider}. API Response: {json.dumps(result, indent=2)}", "FAIL"
+            return f"No analysis result found from {ai_provider}. API Response: {orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()}", "FAIL", None
+
+        # --- Structured output: the response is the JSON issue list itself ---
+        try:
+            issues = issues_from_json(orjson.loads(analysis_text))
+        except orjson.JSONDecodeError:
+            issues = None
+        if issues is not None:
+            # Any reported issue fails the check, including ones not tied to a diff line
+            return format_issues_report(issues), "FAIL" if issues else "PASS", issues
 
-        # --- Parse the analysis_text to separate report from status ---
+        # --- Fallback for free-text responses: separate report from status ---
         report_text = analysis_text
         status_value = "FAIL" # Default status
 
-        # Split the response into lines to find the status line at the very end
-        report_lines = analysis_text.splitlines()
-        
+        # Split off the last line to find the status line at the very end
+        head, _, last_line = analysis_text.rstrip().rpartition('\n')
+
         # Check if the last line contains the status phrase
-        if report_lines and "Overall Status:" in report_lines[-1]:
-            last_line = report_lines[-1].strip()
-            if "PASS" in last_line.upper():
+        if "Overall Status:" in last_line:
+            last_line = last_line.strip().upper()
+            if "PASS" in last_line:
                 status_value = "PASS"
-            elif "FAIL" in last_line.upper():
+            elif "FAIL" in last_line:
                 status_value = "FAIL"
             # Remove the status line from the report text for cleaner output
-            report_text = "\n".join(report_lines[:-1]).strip()
+            report_text = head.strip()
         else:
             # If the AI didn't explicitly provide the status line, try to infer.
             # This is a fallback and can be less reliable.
@@ -207,17 +265,17 @@ def analyze_merge_issues(
             # This logic can be refined based on AI's typical response patterns
             # For now, if no "PASS" is found and issues are mentioned, it implies a "FAIL"
 
-        return report_text, status_value
+        return report_text, status_value, None
 
     except requests.exceptions.RequestException as e:
         # Catch network-related errors, timeouts, etc.
-        return f"Error calling {ai_provider} API: {e}. Please check network connection, API key, model name, or base URL.", "FAIL"
-    except json.JSONDecodeError:
+        return f"Error calling {ai_provider} API: {e}. Please check network connection, API key, model name, or base URL.", "FAIL", None
+    except orjson.JSONDecodeError:
         # Catch errors if the API response is not valid JSON
-        return f"Error: Failed to decode JSON response from {ai_provider} API. Response content: {response.text}", "FAIL"
+        return f"Error: Failed to decode JSON response from {ai_provider} API. Response content: {response.text}", "FAIL", None
     except Exception as e:
         # Catch any other unexpected errors
-        return f"An unexpected error occurred during analysis: {e}", "FAIL"
+        return f"An unexpected error occurred during analysis: {e}", "FAIL", None
 
 if __name__ == "__main__":
     # This block executes when the script is run directly (e.g., by GitHub Actions)
@@ -228,6 +286,7 @@ if __name__ == "__main__":
     api_key = os.environ.get('AI_API_KEY', '').strip()
     api_base_url = os.environ.get('API_BASE_URL', '').strip()
     model_name = os.environ.get('MODEL_NAME', '').strip()
+    compress_request = os.environ.get('COMPRESS_REQUEST', '').strip().lower() == 'true'
 
     # Provide default values if not explicitly set (e.g., for local testing or unexpected edge cases)
     if not ai_provider:
@@ -241,13 +300,19 @@ if __name__ == "__main__":
             model_name = 'default-model' # Generic fallback
 
     # Perform the analysis
-    report, status = analyze_merge_issues(diff_data, ai_provider, api_key, model_name, api_base_url)
+    report, status, issues = analyze_merge_issues(diff_data, ai_provider, api_key, model_name, api_base_url, compress_request)
 
     # Write the results to files. GitHub Actions will read these files.
     with open('ai_analysis_report.txt', 'w') as f:
         f.write(report)
     with open('ai_analysis_status.txt', 'w') as f:
         f.write(status)
+    # Structured issues let the inline-comment step skip parsing the report text
+    if issues is not None:
+        with open('ai_analysis_issues.json', 'wb') as f:
+            f.write(orjson.dumps(issues))
+    elif os.path.exists('ai_analysis_issues.json'):
+        os.remove('ai_analysis_issues.json')
 
     # Optional: Print to console for debugging purposes in GitHub Actions logs
     # print("\n--- AI Analysis Report ---")
@@ -1,11 +1,73 @@
-from unidiff import PatchSet
+from typing import Iterable, Optional, Tuple
+
+def _parse_hunk_range(spec: str) -> Optional[Tuple[int, int]]:
+    """
+    Parses one side of a hunk header, e.g. "14,8" -> (14, 8) or "14" -> (14, 1).
+    Returns None if spec is not a valid range.
+    """
+    start, sep, count = spec.partition(',')
+    if not start.isdigit() or (sep and not count.isdigit()):
+        return None
+    return int(start), int(count) if sep else 1
 
 def get_valid_diff_lines(diff_content: str):
+    """
+    Collects the lines GitHub accepts inline review comments on.
+
+    Args:
+        diff_content: The unified Git diff text.
+
+    Returns:
+        A set of (file path, target line number) tuples, one per added line.
+        Only added lines count; removed and context lines are skipped.
+    """
+    return get_valid_diff_lines_stream(diff_content.splitlines())
+
+def get_valid_diff_lines_stream(diff_lines: Iterable[str]):
+    """
+    Same as get_valid_diff_lines, but consumes the diff one line at a time.
+
+    Args:
+        diff_lines: Any iterable of diff lines, e.g. an open file handle.
+            Trailing newlines are ignored.
+
+    Returns:
+        A set of (file path, target line number) tuples, one per added line.
+    """
     valid_lines = set()
-    patch = PatchSet(diff_content.splitlines(keepends=True))
-    for file in patch:
-        for hunk in file:
-            for line in hunk:
-                if line.is_added:
-                    valid_lines.add((file.path, line.target_line_no))
+    add = valid_lines.add # Bound once; called for every added line
+    cur_path = None
+    new_ln = 0
+    old_left = new_left = 0
+    for line in diff_lines:
+        line = line.rstrip('\r\n')
+        if old_left > 0 or new_left > 0:
+            # Inside a hunk: the header counts tell us where it ends, so
+            # content lines that look like "+++"/"---" headers are safe.
+            tag = line[:1]
+            if tag == '+':
+                add((cur_path, new_ln))
+                new_ln += 1
+                new_left -= 1
+            elif tag == '-':
+                old_left -= 1
+            elif tag == ' ' or not line:
+                new_ln += 1
+                new_left -= 1
+                old_left -= 1
+            # "\ No newline at end of file" does not count towards either side
+            continue
+        if line.startswith('+++ '):
+            path = line[4:].split('\t', 1)[0]
+            cur_path = path[2:] if path.startswith('b/') else path
+        elif line.startswith('@@ -'):
+            # Hunk header, e.g. "@@ -12,7 +14,8 @@ def foo():"
+            parts = line.split(' ', 4)
+            if len(parts) < 4 or parts[3] != '@@' or not parts[2].startswith('+'):
+                continue
+            old_range = _parse_hunk_range(parts[1][1:])
+            new_range = _parse_hunk_range(parts[2][1:])
+            if old_range and new_range:
+                old_left = old_range[1]
+                new_ln, new_left = new_range
     return valid_lines
\ No newline at end of file
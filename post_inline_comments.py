@@ -1,33 +1,78 @@
 import os
 import sys
+import json
+import hashlib
+import tempfile
+import time
 import requests
-from ai_postprocess import parse_ai_issues
-from diff_parser import get_valid_diff_lines
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ai_postprocess import PARSER_VERSION, parse_ai_issues, is_inline_issue
+from diff_parser import get_valid_diff_lines_stream
 
-# Load AI analysis report
+# Times a comment POST is retried after hitting GitHub's (secondary) rate limit
+MAX_RATE_LIMIT_RETRIES = 3
+
+# Load AI analysis issues: prefer the structured JSON written by analyze_diff.py,
+# fall back to parsing the free-text report.
+# (stdlib json here rather than orjson so this script also runs under PyPy.)
+ISSUES_PATH = "ai_analysis_issues.json"
 REPORT_PATH = "ai_analysis_report.txt"
-if not os.path.exists(REPORT_PATH):
-    print(f"Error: {REPORT_PATH} not found.")
-    sys.exit(1)
+if os.path.exists(ISSUES_PATH):
+    with open(ISSUES_PATH, "r") as f:
+        # Issues without a file and line stay in the report only
+        issues = [issue for issue in json.load(f) if is_inline_issue(issue)]
+else:
+    if not os.path.exists(REPORT_PATH):
+        print(f"Error: {REPORT_PATH} not found.")
+        sys.exit(1)
+
+    with open(REPORT_PATH, "r") as f:
+        report_text = f.read()
 
-with open(REPORT_PATH, "r") as f:
-    report_text = f.read()
+    # Parsed issues are cached by parser version and report content, so a retried
+    # run skips re-parsing; anything malformed in the cache counts as a miss.
+    report_hash = hashlib.sha256(report_text.encode()).hexdigest()
+    parsed_cache_path = os.path.join(
+        tempfile.gettempdir(), f"ai_issues_v{PARSER_VERSION}_{report_hash}.json"
+    )
+    try:
+        with open(parsed_cache_path, "r") as f:
+            issues = json.load(f)
+    except (OSError, ValueError):
+        issues = None
+    if not isinstance(issues, list) or not all(
+        isinstance(issue, dict) and is_inline_issue(issue)
+        and all(isinstance(issue.get(key), str) for key in ("problem", "why", "solution"))
+        for issue in issues
+    ):
+        issues = parse_ai_issues(report_text)
+        try:
+            with open(parsed_cache_path, "w") as f:
+                json.dump(issues, f)
+        except OSError:
+            pass
 
-issues = parse_ai_issues(report_text)
 if not issues:
     print("No issues found to post as inline comments.")
     sys.exit(0)
 
+# Group issues by location so each (file, line) gets a single comment
+merged = {}
+for issue in issues:
+    group = merged.setdefault((issue['file'], issue['line']), [])
+    if issue not in group:
+        group.append(issue)
+
 # Load diff content and get valid lines for inline comments
 DIFF_PATH = "diff.txt"
 if not os.path.exists(DIFF_PATH):
     print(f"Error: {DIFF_PATH} not found.")
     sys.exit(1)
 
+# Stream the diff line by line rather than reading the whole file into memory
 with open(DIFF_PATH, "r") as f:
-    diff_content = f.read()
-
-valid_lines = get_valid_diff_lines(diff_content)
+    valid_lines = get_valid_diff_lines_stream(f)
 
 # GitHub environment variables
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
@@ -45,34 +90,137 @@ headers = {
     "Authorization": f"token {GITHUB_TOKEN}",
     "Accept": "application/vnd.github+json"
 }
+
+# Reuse one keep-alive connection to api.github.com for every request below
+session = requests.Session()
+session.headers.update(headers)
+adapter = HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=1,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+)
+session.mount("https://", adapter)
+
+# Cache the PR head SHA with its ETag so repeated runs can use a conditional GET
+PR_CACHE_PATH = os.path.join(tempfile.gettempdir(), f"pr_etag_{owner}_{repo}_{PR_NUMBER}.json")
+pr_cache = {}
+if os.path.exists(PR_CACHE_PATH):
+    try:
+        with open(PR_CACHE_PATH, "r") as f:
+            pr_cache = json.load(f)
+    except (OSError, ValueError):
+        pr_cache = {}
+
 pr_url = f"https://api.github.com/repos/{owner}/{repo}/pulls/{PR_NUMBER}"
-pr_resp = requests.get(pr_url, headers=headers)
-if pr_resp.status_code != 200:
+conditional_headers = {"If-None-Match": pr_cache["etag"]} if pr_cache.get("etag") and pr_cache.get("commit_id") else {}
+pr_resp = session.get(pr_url, headers=conditional_headers)
+if pr_resp.status_code == 304:
+    # Unchanged since the cached response; reuse its head SHA
+    commit_id = pr_cache["commit_id"]
+elif pr_resp.status_code == 200:
+    commit_id = pr_resp.json()["head"]["sha"]
+    if pr_resp.headers.get("ETag"):
+        try:
+            with open(PR_CACHE_PATH, "w") as f:
+                json.dump({"etag": pr_resp.headers["ETag"], "commit_id": commit_id}, f)
+        except OSError:
+            pass
+else:
     print(f"Failed to fetch PR info: {pr_resp.text}")
     sys.exit(1)
-commit_id = pr_resp.json()["head"]["sha"]
 
-# Post inline comments for each issue, only if (file, line) is valid in the diff
-for issue in issues:
-    if (issue['file'], issue['line']) not in valid_lines:
-        print(f"Skipping hallucinated issue: {issue['file']}:{issue['line']}")
+# Build one comment payload per location, only if (file, line) is valid in the diff
+tasks = []
+for (file, line), group in merged.items():
+    if (file, line) not in valid_lines:
+        print(f"Skipping hallucinated issue: {file}:{line}")
         continue
-    comment_body = (
-        f"**AI Merge Analyzer Issue**\n\n"
+    comment_body = "**AI Merge Analyzer Issue**\n\n" + "\n".join(
         f"**Problem:** {issue['problem']}\n"
         f"**Why:** {issue['why']}\n"
         f"**Solution:** {issue['solution']}\n"
+        for issue in group
     )
     payload = {
         "body": comment_body,
         "commit_id": commit_id,
-        "path": issue["file"],
-        "line": issue["line"],
+        "path": file,
+        "line": line,
         "side": "RIGHT"
     }
-    comment_url = f"https://api.github.com/repos/{owner}/{repo}/pulls/{PR_NUMBER}/comments"
-    resp = requests.post(comment_url, headers=headers, json=payload)
+    tasks.append(((file, line), payload))
+
+if not tasks:
+    print("No valid diff lines to comment on.")
+    sys.exit(0)
+
+def post_with_rate_limit_retry(url: str, payload: dict) -> requests.Response:
+    """
+    POSTs payload through the shared session, waiting and retrying when GitHub
+    answers 403/429 because of a (secondary) rate limit.
+
+    Args:
+        url: The GitHub API URL to post to.
+        payload: The JSON request body.
+
+    Returns:
+        The final response; a 403 that is not rate limiting is returned as-is.
+    """
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        resp = session.post(url, json=payload)
+        if resp.status_code not in (403, 429) or attempt == MAX_RATE_LIMIT_RETRIES:
+            return resp
+        retry_after = resp.headers.get("Retry-After", "")
+        reset = resp.headers.get("X-RateLimit-Reset", "")
+        if retry_after.isdigit():
+            delay = int(retry_after)
+        elif resp.headers.get("X-RateLimit-Remaining") == "0" and reset.isdigit():
+            delay = max(int(reset) - int(time.time()), 1)
+        elif resp.status_code == 429:
+            delay = 60
+        else:
+            # A plain 403 (e.g. missing permissions) will not succeed on retry
+            return resp
+        print(f"Rate limited by GitHub, retrying in {delay}s")
+        time.sleep(delay)
+    return resp
+
+# Submit every inline comment in a single review: one request instead of one per comment
+review_payload = {
+    "commit_id": commit_id,
+    "event": "COMMENT",
+    "comments": [
+        {"path": p["path"], "line": p["line"], "side": p["side"], "body": p["body"]}
+        for _, p in tasks
+    ]
+}
+try:
+    review_resp = session.post(f"{pr_url}/reviews", json=review_payload)
+except requests.exceptions.RequestException as e:
+    print(f"Failed to submit review: {e}")
+    sys.exit(1)
+if review_resp.status_code == 200:
+    for (file, line), _ in tasks:
+        print(f"Posted inline comment for {file}:{line}")
+    sys.exit(0)
+if review_resp.status_code != 422:
+    # Anything else (e.g. a gateway 502/504) may have come back after GitHub already
+    # created the review, so posting the comments again could duplicate them.
+    print(f"Failed to submit review ({review_resp.status_code}): {review_resp.text}")
+    sys.exit(1)
+
+# GitHub rejects the whole review (422) if any one comment location is invalid, so
+# fall back to posting comments individually. Content-creating requests are sent one at a time,
+# as GitHub's REST guidance asks, to stay clear of secondary rate limits.
+print(f"Failed to submit review ({review_resp.status_code}), posting comments individually: {review_resp.text}")
+comment_url = f"{pr_url}/comments"
+for (file, line), payload in tasks:
+    try:
+        resp = post_with_rate_limit_retry(comment_url, payload)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to post comment for {file}:{line}: {e}")
+        continue
     if resp.status_code == 201:
-        print(f"Posted inline comment for {issue['file']}:{issue['line']}")
+        print(f"Posted inline comment for {file}:{line}")
     else:
-        print(f"Failed to post comment for {issue['file']}:{issue['line']}")
\ No newline at end of file
+        print(f"Failed to post comment for {file}:{line} ({resp.status_code}): {resp.text}")
\ No newline at end of file